@@ -0,0 +1,231 @@
+"""價格警示引擎：以代碼索引規則，只針對報價有變動的代碼重新評估。
+
+規則種類：
+- price:    股價 >= / <= 門檻
+- pct:      日漲跌% >= / <= 門檻
+- roi:      持股報酬率% (現價對平均成本) >= / <= 門檻
+- drawdown: 投資組合淨資產自高點回撤% >= 門檻 (掛在 PORTFOLIO 這個虛擬代碼下)
+
+觸發採邊緣觸發：條件由不成立變為成立時才發出警示，同一規則同一天只記錄一次 (去重)。
+規則與已觸發警示以「只附加」的 JSONL 紀錄檔 (add / del / fire 三種事件) 存放在本機。
+同一使用者可能同時開多個 session (各自一個引擎)：每個引擎記住已讀到的位元組位置，
+變更前在檔案鎖內只讀取其他 session 新附加的事件再附加自己的一行，成本與變更筆數成正比，
+不需重新解析整個檔案。紀錄過長時會壓縮改寫，其他 session 偵測到檔案被替換後再整份重讀。
+本模組不 import streamlit。
+"""
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+RULE_KINDS = {'price': '股價', 'pct': '日漲跌%', 'roi': '持股報酬率%', 'drawdown': '投組回撤%'}
+PORTFOLIO = '*'
+MAX_FIRED = 200
+COMPACT_LINES = 5000     # 紀錄檔行數下限，超過且多為已失效事件時壓縮為目前的規則與最近警示
+
+_FILE_LOCKS = {}
+_FILE_LOCKS_GUARD = threading.Lock()
+
+def _file_lock(path):
+    """同一行程內，同一個警示檔共用一把鎖"""
+    with _FILE_LOCKS_GUARD:
+        return _FILE_LOCKS.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def _now():
+    return datetime.utcnow() + timedelta(hours=8)
+
+def _check(value, op, threshold):
+    return value >= threshold if op == '>=' else value <= threshold
+
+
+class AlertEngine:
+    def __init__(self, path):
+        self.path = path
+        self.rules = {}         # rule_id -> rule
+        self.by_symbol = {}     # symbol -> {rule_id: rule}
+        self.fired = []         # 已觸發警示 (舊 -> 新)
+        self.pending = []       # 尚未顯示給使用者的新警示
+        self._fired_keys = set()
+        self._active = set()    # 目前條件成立中的 rule_id (邊緣觸發用)
+        self._last = {}         # symbol -> 上次評估時的報價簽章
+        self._offset = 0        # 已讀取到的紀錄檔位元組位置
+        self._inode = None      # 紀錄檔被壓縮替換時 inode 會改變
+        self._lines = 0
+        self._lock = _file_lock(path)
+        with self._lock:
+            self._sync()
+
+    # --- 儲存 (呼叫端需持有 self._lock) ---
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_ino, st.st_size
+        except OSError:
+            return None, 0
+
+    def _apply(self, event):
+        """套用一筆事件，回傳受影響的代碼 (規則變動時) 或 None"""
+        op = event.get('op')
+        if op == 'add':
+            rule = event['rule']
+            self._index(rule)
+            return rule['symbol']
+        if op == 'del':
+            rule = self.rules.pop(event['id'], None)
+            if rule is None: return None
+            bucket = self.by_symbol.get(rule['symbol'], {})
+            bucket.pop(rule['id'], None)
+            if not bucket: self.by_symbol.pop(rule['symbol'], None)
+            self._active.discard(rule['id'])
+            return rule['symbol']
+        if op == 'fire':
+            alert = event['alert']
+            self.fired.append(alert)
+            self._fired_keys.add((alert['rule_id'], alert['date']))
+            if len(self.fired) > 2 * MAX_FIRED:
+                self.fired = self.fired[-MAX_FIRED:]
+                self._fired_keys = {(a['rule_id'], a['date']) for a in self.fired}
+        return None
+
+    def _sync(self):
+        """只讀取自上次以來新附加的事件；檔案被替換或截短時整份重讀。回傳規則有變動的代碼"""
+        inode, size = self._stat()
+        if inode != self._inode or size < self._offset:
+            self.rules, self.by_symbol, self.fired, self._fired_keys = {}, {}, [], set()
+            self._offset, self._lines, self._inode = 0, 0, inode
+            self._last.clear()
+        if size == self._offset: return set()
+
+        changed = set()
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'): break   # 其他行程寫到一半的行，下次再讀
+                self._offset += len(line)
+                self._lines += 1
+                try: symbol = self._apply(json.loads(line))
+                except (ValueError, KeyError): continue
+                if symbol: changed.add(symbol)
+        return changed
+
+    def _append(self, *events):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'ab') as f:
+            for event in events:
+                f.write((json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8'))
+            self._offset = f.tell()
+        self._lines += len(events)
+        self._inode = self._stat()[0]
+        # 紀錄行數超過有效事件 (規則 + 保留的警示) 兩倍才壓縮，攤提後每次附加仍為 O(1)
+        if self._lines > max(COMPACT_LINES, 2 * (len(self.rules) + len(self.fired))): self._compact()
+
+    def _compact(self):
+        events = [{'op': 'add', 'rule': r} for r in self.rules.values()]
+        events += [{'op': 'fire', 'alert': a} for a in self.fired[-MAX_FIRED:]]
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'wb') as f:
+            for event in events:
+                f.write((json.dumps(event, ensure_ascii=False) + '\n').encode('utf-8'))
+        os.replace(tmp, self.path)
+        self._inode, self._offset = self._stat()
+        self._lines = len(events)
+
+    def refresh(self):
+        """其他 session 附加了新事件時增量載入；只有規則變動的代碼下次報價需重新評估"""
+        if self._stat() == (self._inode, self._offset): return
+        with self._lock:
+            changed = self._sync()
+        for symbol in changed:
+            self._last.pop(symbol, None)
+
+    # --- 規則管理 ---
+    def _index(self, rule):
+        self.rules[rule['id']] = rule
+        self.by_symbol.setdefault(rule['symbol'], {})[rule['id']] = rule
+
+    def add_rule(self, kind, symbol, op, value, note=''):
+        if kind not in RULE_KINDS:
+            raise ValueError(f"未知的警示種類: {kind}")
+        if kind == 'drawdown':
+            symbol, op = PORTFOLIO, '>='
+        rule = {'id': uuid.uuid4().hex[:8], 'kind': kind, 'symbol': str(symbol).strip().upper(),
+                'op': op, 'value': float(value), 'note': note}
+        with self._lock:
+            self._sync()
+            self._apply({'op': 'add', 'rule': rule})
+            self._append({'op': 'add', 'rule': rule})
+        # 讓新規則在下一次報價時立即評估
+        self._last.pop(rule['symbol'], None)
+        return rule
+
+    def remove_rule(self, rule_id):
+        with self._lock:
+            self._sync()
+            if rule_id not in self.rules: return
+            self._apply({'op': 'del', 'id': rule_id})
+            self._append({'op': 'del', 'id': rule_id})
+
+    def describe(self, rule):
+        target = '投資組合' if rule['symbol'] == PORTFOLIO else rule['symbol']
+        return f"{target} {RULE_KINDS[rule['kind']]} {rule['op']} {rule['value']:g}"
+
+    # --- 評估 ---
+    def _evaluate(self, symbol, values):
+        """values: {kind: 目前數值}；只評估掛在 symbol 下的規則，回傳新觸發的警示"""
+        new = []
+        for rule in self.by_symbol.get(symbol, {}).values():
+            val = values.get(rule['kind'])
+            if val is None: continue
+            if not _check(val, rule['op'], rule['value']):
+                self._active.discard(rule['id'])
+                continue
+            if rule['id'] in self._active: continue
+            self._active.add(rule['id'])
+
+            now = _now()
+            alert = {'rule_id': rule['id'], 'date': now.strftime('%Y-%m-%d'), 'time': now.strftime('%Y/%m/%d %H:%M:%S'),
+                     'symbol': symbol, 'kind': rule['kind'], 'value': round(val, 4),
+                     'message': f"{self.describe(rule)} (目前 {val:,.2f})"}
+            new.append(alert)
+        if not new: return []
+
+        # 先讀入其他 session 新附加的事件再去重，只附加新觸發的警示
+        with self._lock:
+            self._sync()
+            new = [a for a in new if a['rule_id'] in self.rules and (a['rule_id'], a['date']) not in self._fired_keys]
+            for a in new:
+                self._apply({'op': 'fire', 'alert': a})
+            if new:
+                self._append(*({'op': 'fire', 'alert': a} for a in new))
+        self.pending.extend(new)
+        return new
+
+    def on_quote(self, symbol, quote, holding=None):
+        """輸入單一報價 (fetch_stock_price_robust 的回傳格式)；報價未變動或無規則時不評估"""
+        symbol = str(symbol).strip().upper()
+        self.refresh()
+        price = quote.get('p', 0)
+        if symbol not in self.by_symbol or price <= 0: return []
+        sig = (price, quote.get('pct', 0))
+        if self._last.get(symbol) == sig: return []
+        self._last[symbol] = sig
+
+        values = {'price': price, 'pct': quote.get('pct', 0)}
+        cost = (holding or {}).get('c', 0)
+        if cost > 0: values['roi'] = (price / cost - 1) * 100
+        return self._evaluate(symbol, values)
+
+    def on_portfolio(self, net_asset, peak):
+        """以淨資產與歷史高點評估投組回撤規則；數值未變動時不評估"""
+        self.refresh()
+        if PORTFOLIO not in self.by_symbol or peak <= 0: return []
+        sig = (round(net_asset, 2), round(peak, 2))
+        if self._last.get(PORTFOLIO) == sig: return []
+        self._last[PORTFOLIO] = sig
+        return self._evaluate(PORTFOLIO, {'drawdown': max(0.0, (peak - net_asset) / peak * 100)})
+
+    def pop_pending(self):
+        new, self.pending = self.pending, []
+        return new
@@ -1,16 +1,40 @@
+import time
+_SCRIPT_START = time.perf_counter()
+
 import streamlit as st
-import pandas as pd
-import yfinance as yf
 import requests
-import time
 import json
-import gspread
-from google.oauth2.service_account import Credentials
+import os
+import sys
+import importlib
 from datetime import datetime, timedelta
-import plotly.express as px
-import plotly.graph_objects as go
 import urllib3
 
+# --- 效能量測 (匯入耗時 / 首次繪製時間) ---
+# 每次 rerun 都會重新執行本檔，因此 PERF_MARKS 只記錄本次執行的量測值
+PERF_MARKS = {'import_core_ms': round((time.perf_counter() - _SCRIPT_START) * 1000, 1)}
+
+def show_perf():
+    """secrets 設定 show_perf = true 時才輸出效能量測 (log 與側邊欄)"""
+    try: return bool(st.secrets.get("show_perf", False))
+    except Exception: return False
+
+def perf_mark(label, elapsed_ms=None):
+    """記錄一個效能標記 (預設為距離本次執行開始的毫秒數)"""
+    if elapsed_ms is None:
+        elapsed_ms = (time.perf_counter() - _SCRIPT_START) * 1000
+    PERF_MARKS[label] = round(elapsed_ms, 1)
+    if show_perf(): print(f"[perf] {label}: {elapsed_ms:.1f} ms")
+
+def lazy_import(module_name):
+    """首次使用時才載入重型套件 (yfinance / plotly / gspread / pandas)，並記錄載入耗時"""
+    mod = sys.modules.get(module_name)
+    if mod is not None: return mod
+    t0 = time.perf_counter()
+    mod = importlib.import_module(module_name)
+    perf_mark(f"import_{module_name}_ms", (time.perf_counter() - t0) * 1000)
+    return mod
+
 # 忽略 SSL 警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -28,25 +52,14 @@ if 'app_version' not in st.session_state or st.session_state.app_version != APP_
 st.set_page_config(page_title=f"資產管家 Pro {APP_VERSION}", layout="wide", page_icon="🛡️")
 
 # --- Google Sheets 連線與資料處理 ---
+@st.cache_resource(show_spinner=False)
+def _build_google_client():
+    """憑證與 gspread client 每個行程只建立一次 (失敗時不快取，下次重試)"""
+    return lazy_import("storage").authorize_client(st.secrets["service_account_info"])
+
 def get_google_client():
     try:
-        scope = [
-            'https://www.googleapis.com/auth/spreadsheets',
-            'https://www.googleapis.com/auth/drive'
-        ]
-        secret_info = st.secrets["service_account_info"]
-        
-        if isinstance(secret_info, str):
-            creds_dict = json.loads(secret_info, strict=False)
-        else:
-            creds_dict = dict(secret_info)
-            
-        if 'private_key' in creds_dict:
-            creds_dict['private_key'] = creds_dict['private_key'].replace('\\n', '\n')
-            
-        creds = Credentials.from_service_account_info(creds_dict, scopes=scope)
-        client = gspread.authorize(creds)
-        return client
+        return _build_google_client()
     except Exception as e:
         st.error(f"❌ Google Sheet 連線失敗: {e}")
         st.stop()
@@ -54,6 +67,7 @@ def get_google_client():
 # --- 智能分頁搜尋 (忽略大小寫) ---
 def get_ws_ci(spreadsheet, title):
     """大小寫不敏感的工作表搜尋"""
+    gspread = lazy_import("gspread")
     target = str(title).strip().lower()
     for ws in spreadsheet.worksheets():
         if ws.title.lower() == target:
@@ -61,6 +75,7 @@ def get_ws_ci(spreadsheet, title):
     raise gspread.exceptions.WorksheetNotFound(title)
 
 def get_worksheet(spreadsheet, sheet_name, rows="100", cols="10", default_header=None):
+    gspread = lazy_import("gspread")
     try:
         return get_ws_ci(spreadsheet, sheet_name)
     except gspread.exceptions.WorksheetNotFound:
@@ -77,6 +92,9 @@ def load_data(client, username):
     default = {'h': {}, 'cash': 0.0, 'principal': 0.0, 'history': [], 'asset_history': [], 'is_legacy': False}
     
     if not client or not username: return default
+    gspread = lazy_import("gspread")
+    storage = lazy_import("storage")
+    clean_num = storage.clean_num
 
     try:
         spreadsheet = client.open(st.secrets["spreadsheet_name"])
@@ -84,14 +102,6 @@ def load_data(client, username):
         st.error(f"❌ 無法開啟試算表: {st.secrets['spreadsheet_name']}。請檢查權限或檔名。錯誤: {e}")
         st.stop()
 
-    def clean_num(val):
-        try:
-            if isinstance(val, (int, float)): return float(val)
-            if not val: return 0.0
-            s = str(val).replace(',', '').replace('$', '').replace(' ', '').replace('%', '').strip()
-            return float(s)
-        except: return 0.0
-
     # 1. 讀取 User (庫存)
     h_data = {}
     legacy_json = None
@@ -107,28 +117,13 @@ def load_data(client, username):
         
         # 偵測是否為舊版 JSON 格式
         if all_rows_vals and len(all_rows_vals) > 0:
-            first_cell = str(all_rows_vals[0][0]).strip()
-            if first_cell.startswith('{') and "Code" not in all_rows_vals[0]:
+            if storage.is_legacy_cell(all_rows_vals[0][0]) and "Code" not in all_rows_vals[0]:
                 is_legacy = True
         
         if is_legacy:
             try:
-                raw_json = all_rows_vals[0][0]
-                legacy_json = json.loads(raw_json)
-                # 雙層解析保護 (若存入時被二次轉字串)
-                if isinstance(legacy_json, str):
-                    legacy_json = json.loads(legacy_json)
-                    
-                raw_h = legacy_json.get('h', {})
-                for code, info in raw_h.items():
-                    h_data[code] = {
-                        'n': info.get('n', code),
-                        'ex': info.get('ex', ''),
-                        's': clean_num(info.get('s', 0)),
-                        'c': clean_num(info.get('c', 0)),
-                        'last_p': 0,
-                        'lots': info.get('lots', [])
-                    }
+                legacy_json = storage.load_legacy_json(all_rows_vals[0][0])
+                h_data = storage.legacy_holdings(legacy_json)
             except Exception as e:
                 st.error(f"⚠️ 舊版資料解析失敗: {e}")
         else:
@@ -189,12 +184,7 @@ def load_data(client, username):
     asset_history = []
     
     if legacy_json and 'history' in legacy_json:
-        for h in legacy_json['history']:
-            hist_data.append({
-                'Date': h.get('d'), 'Code': h.get('code'), 'Name': h.get('name'),
-                'Qty': h.get('qty'), 'BuyCost': h.get('buy_cost'), 
-                'SellRev': h.get('sell_rev'), 'Profit': h.get('profit'), 'ROI': h.get('roi')
-            })
+        hist_data = storage.legacy_history(legacy_json)
 
     try:
         try:
@@ -248,18 +238,7 @@ def save_data(client, username, data):
         try: user_ws = get_ws_ci(spreadsheet, f"User_{username}")
         except: user_ws = spreadsheet.add_worksheet(f"User_{username}", 100, 10)
         
-        headers = ['Code', 'Name', 'Exchange', 'Shares', 'AvgCost', 'Lots_Data', 'LastPrice']
-        rows = [headers]
-        for code, info in data.get('h', {}).items():
-            current_p = info.get('last_p', 0)
-            if current_p == 0: current_p = info.get('c', 0)
-            
-            rows.append([
-                code, info.get('n', ''), info.get('ex', ''),
-                float(info.get('s', 0)), float(info.get('c', 0)),
-                json.dumps(info.get('lots', []), ensure_ascii=False),
-                float(current_p)
-            ])
+        rows = lazy_import("storage").build_user_rows(data.get('h', {}))
         user_ws.clear()
         user_ws.update('A1', rows)
         
@@ -305,12 +284,14 @@ def get_audit_logs(client, username, limit=50):
 @st.cache_data(ttl=300)
 def get_usdtwd():
     try:
+        yf = lazy_import("yfinance")
         t = yf.Ticker("USDTWD=X")
         return t.history(period="1d")['Close'].iloc[-1]
     except: return 32.5
 
 @st.cache_data(ttl=3600)
 def get_benchmark_data(start_date):
+    yf = lazy_import("yfinance")
     benchmarks = {}
     target_tickers = [('0050.TW', '台灣50'), ('SPY', 'S&P 500'), ('QQQ', 'NASDAQ 100')]
     for code, name in target_tickers:
@@ -324,6 +305,50 @@ def get_benchmark_data(start_date):
         except: pass
     return benchmarks
 
+SIM_MIN_HISTORY_DAYS = 30  # 模擬所需的最少共同歷史交易日
+
+def to_yf_code(code, exchange=''):
+    """轉為 Yahoo 代碼：上櫃 (otc) 加 .TWO，上市 (tse) 或台股代碼 (4 碼數字開頭，如 00679B) 加 .TW"""
+    c = str(code).strip().upper()
+    if c.endswith('.TW') or c.endswith('.TWO'): return c
+    if exchange == 'otc': return f"{c}.TWO"
+    if exchange == 'tse' or c[:4].isdigit(): return f"{c}.TW"
+    return c
+
+def yf_candidates(code, exchange=''):
+    """
+    可能的 Yahoo 代碼 (依優先順序)。買入流程對所有台股都記錄 ex='tse'，上櫃股票實際上要用 .TWO，
+    因此未明確帶後綴的台股同時嘗試 .TW 與 .TWO。
+    """
+    yf_code = to_yf_code(code, exchange)
+    if yf_code.endswith('.TW') and not str(code).strip().upper().endswith('.TW'):
+        return [yf_code, f"{yf_code[:-3]}.TWO"]
+    return [yf_code]
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_price_history(holdings, period="2y"):
+    """
+    抓取持股歷史收盤價 (供情境模擬使用)。holdings 為 ((code, exchange), ...)。
+    欄名為原始代碼，休市日以前值補齊；Yahoo 未回傳的代碼整欄為 NaN，由呼叫端檢查。
+    """
+    yf = lazy_import("yfinance")
+    pd = lazy_import("pandas")
+    candidates = {code: yf_candidates(code, ex) for code, ex in holdings}
+    tickers = sorted({t for ts in candidates.values() for t in ts})
+    try:
+        raw = yf.download(tickers, period=period, auto_adjust=True, progress=False)
+    except Exception: return None
+    if raw is None or raw.empty: return None
+    
+    close = raw['Close']
+    if not isinstance(close, pd.DataFrame): close = close.to_frame(tickers[0])
+    # 每檔取第一個有資料的候選代碼 (例如 .TW 為空時改用 .TWO)
+    out = pd.DataFrame(index=close.index)
+    for code, ts in candidates.items():
+        found = next((t for t in ts if t in close.columns and close[t].notna().any()), None)
+        out[code] = close[found] if found else float('nan')
+    return out.dropna(how='all').sort_index().ffill()
+
 def fetch_stock_price_robust(code, exchange=''):
     code = str(code).strip().upper()
     is_tw = ('.TW' in code) or ('.TWO' in code) or (code.isdigit())
@@ -357,6 +382,7 @@ def fetch_stock_price_robust(code, exchange=''):
     if is_tw and '.TW' not in yf_code and '.TWO' not in yf_code: yf_code = f"{code}.TW"
     
     try:
+        yf = lazy_import("yfinance")
         t = yf.Ticker(yf_code)
         hist = t.history(period="1d")
         if not hist.empty:
@@ -374,7 +400,8 @@ def fetch_stock_price_robust(code, exchange=''):
 
     return {'p': 0, 'chg': 0, 'pct': 0, 'n': code, 'src': 'Fail'}
 
-def update_prices_batch(portfolio):
+def update_prices_batch(portfolio, on_quote=None):
+    """逐檔更新報價；on_quote(code, quote, holding) 會在每筆報價取得後立即呼叫 (供警示引擎使用)"""
     results = {}
     progress_bar = st.progress(0)
     total = len(portfolio)
@@ -382,13 +409,98 @@ def update_prices_batch(portfolio):
         ex = info.get('ex', '')
         res = fetch_stock_price_robust(code, ex)
         results[code] = res
+        if on_quote: on_quote(code, res, info)
         progress_bar.progress((i + 1) / total)
     progress_bar.empty()
     return results
 
+# --- 價格警示 ---
+def get_alert_engine(username):
+    """每位使用者一個警示引擎 (存於 session_state)，規則與觸發紀錄寫入本機 JSON"""
+    key = f"alert_engine_{username}"
+    if key not in st.session_state:
+        alerts_dir = st.secrets.get("alerts_dir", ".alerts")
+        st.session_state[key] = lazy_import("alerts").AlertEngine(os.path.join(alerts_dir, f"{username}.jsonl"))
+    return st.session_state[key]
+
+# --- 資產走勢圖 (降採樣 + WebGL + 圖表快取) ---
+TREND_VIEW_AMOUNT = "💰 淨資產走勢 (金額)"
+TREND_VIEW_ROI = "📈 累計報酬率比較 (%)"
+CHART_MAX_POINTS = 800  # 約等於圖表可視寬度的像素數，超過即降採樣
+
+def lttb_indices(x, y, threshold):
+    """Largest-Triangle-Three-Buckets 降採樣，回傳保留點的索引 (保留首尾與轉折點)"""
+    np = lazy_import("numpy")
+    n = len(y)
+    if threshold >= n or threshold < 3: return np.arange(n)
+    
+    x = np.asarray(x, dtype='float64')
+    y = np.nan_to_num(np.asarray(y, dtype='float64'), nan=0.0, posinf=0.0, neginf=0.0)
+    bucket = (n - 2) / (threshold - 2)
+    idx = np.empty(threshold, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * bucket) + 1
+        end = int((i + 1) * bucket) + 1
+        n_end = min(int((i + 2) * bucket) + 1, n)
+        avg_x = x[end:n_end].mean()
+        avg_y = y[end:n_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        idx[i + 1] = a
+    return idx
+
+def downsample_xy(x, y, max_points=CHART_MAX_POINTS):
+    """將 (日期, 數值) 序列降採樣到圖表可視解析度"""
+    pd = lazy_import("pandas")
+    np = lazy_import("numpy")
+    x = pd.DatetimeIndex(x)
+    y = np.asarray(y, dtype='float64')
+    idx = lttb_indices(x.asi8, y, max_points)
+    return x[idx], y[idx]
+
+def trend_data_version(df_h):
+    """以內容雜湊作為資料版本，資料未變動時圖表直接命中快取"""
+    pd = lazy_import("pandas")
+    return str(pd.util.hash_pandas_object(df_h[['Date', 'NetAsset', 'Principal']], index=False).sum())
+
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def build_trend_figure_json(data_version, view_type, _df_h):
+    """建立資產走勢圖並回傳 figure JSON；_df_h 不參與雜湊，由 data_version 決定快取鍵"""
+    go = lazy_import("plotly.graph_objects")
+    df_h = _df_h
+    fig_trend = go.Figure()
+    
+    if view_type == TREND_VIEW_AMOUNT:
+        x, y = downsample_xy(df_h['Date'], df_h['NetAsset'])
+        fig_trend.add_trace(go.Scattergl(x=x, y=y, name='淨資產', fill='tozeroy', line=dict(color='#00CC96')))
+        x, y = downsample_xy(df_h['Date'], df_h['Principal'])
+        fig_trend.add_trace(go.Scattergl(x=x, y=y, name='投入本金', line=dict(color='#EF553B', dash='dot')))
+        fig_trend.update_layout(yaxis_title="金額 (TWD)")
+    else:
+        roi = ((df_h['NetAsset'] - df_h['Principal']) / df_h['Principal']) * 100
+        x, y = downsample_xy(df_h['Date'], roi)
+        fig_trend.add_trace(go.Scattergl(x=x, y=y, name='我的投資組合', line=dict(color='#00CC96', width=3)))
+        
+        if not df_h.empty:
+            start_date = df_h['Date'].iloc[0].strftime('%Y-%m-%d')
+            benchmarks = get_benchmark_data(start_date)
+            colors = ['#636EFA', '#AB63FA', '#FFA15A']
+            for i, (name, series) in enumerate(benchmarks.items()):
+                x, y = downsample_xy(series.index, series.values)
+                fig_trend.add_trace(go.Scattergl(x=x, y=y, name=name, line=dict(color=colors[i%len(colors)], width=1.5, dash='dot')))
+        
+        fig_trend.update_layout(yaxis_title="累計報酬率 (%)")
+
+    fig_trend.update_layout(hovermode="x unified", height=450)
+    return fig_trend.to_json()
+
 @st.dialog("📋 異動歷程")
 def show_audit_log_modal(logs):
     if logs:
+        pd = lazy_import("pandas")
         st.dataframe(pd.DataFrame(logs, columns=['時間', '動作', '代碼', '金額', '股數', '備註']), use_container_width=True, hide_index=True)
     else:
         st.info("無紀錄")
@@ -417,6 +529,7 @@ if not st.session_state.current_user:
                     st.session_state.current_user = user_match
                     st.rerun()
                 else: st.error("Failed")
+    perf_mark("first_paint_login_ms")
     st.stop()
 
 username = st.session_state.current_user
@@ -433,35 +546,16 @@ data = st.session_state.data
 if not isinstance(data, dict):
     data = {'h': {}, 'cash': 0.0, 'principal': 0.0, 'history': [], 'asset_history': [], 'is_legacy': False}
 
-# --- 自動遷移邏輯 ---
+# --- 自動遷移邏輯 (備援) ---
+# 正常情況下舊版帳戶應已由 `python migration.py` 離線批次遷移完成，這裡只處理漏網帳戶
 if data.get('is_legacy', False):
     with st.spinner("🔄 偵測到舊版資料格式，正在自動進行格式升級與遷移..."):
         try:
-            save_data(client, username, data)
+            spreadsheet = client.open(st.secrets["spreadsheet_name"])
+            res = lazy_import("migration").migrate_account(spreadsheet, username)
+            if res['status'] not in ('migrated', 'skipped'):
+                raise Exception(res['status'])
             
-            if data['history']:
-                spreadsheet = client.open(st.secrets["spreadsheet_name"])
-                try:
-                    r_ws = get_ws_ci(spreadsheet, f"Realized_{username}")
-                    if len(r_ws.get_all_values()) <= 1: 
-                        raise Exception("Empty sheet")
-                except:
-                    try: r_ws = get_ws_ci(spreadsheet, f"Realized_{username}")
-                    except: r_ws = spreadsheet.add_worksheet(f"Realized_{username}", 100, 10)
-                    
-                    r_ws.clear()
-                    r_ws.append_row(['Date', 'Code', 'Name', 'Qty', 'BuyCost', 'SellRev', 'Profit', 'ROI'])
-                    
-                    rows_to_add = []
-                    for h in data['history']:
-                        rows_to_add.append([
-                            h.get('Date'), h.get('Code'), h.get('Name'), 
-                            h.get('Qty'), h.get('BuyCost'), h.get('SellRev'), 
-                            h.get('Profit'), h.get('ROI')
-                        ])
-                    if rows_to_add:
-                        r_ws.append_rows(rows_to_add)
-
             st.toast("✅ 資料格式升級完成！", icon="🎉")
             data['is_legacy'] = False
             time.sleep(1)
@@ -472,7 +566,7 @@ if data.get('is_legacy', False):
 with st.sidebar:
     st.title(f"👤 {username}")
     if st.button("Logout"):
-        st.session_state.current_user = None; st.session_state.data = None; st.rerun()
+        st.session_state.current_user = None; st.session_state.data = None; st.session_state.pop('sim_result', None); st.rerun()
     st.markdown("---")
     st.metric("💵 現金", f"${int(data['cash']):,}")
     
@@ -496,6 +590,7 @@ with st.sidebar:
         if st.button("確認買入", type="primary"):
             if b_code and b_price > 0:
                 info = fetch_stock_price_robust(b_code)
+                get_alert_engine(username).on_quote(b_code, info, data['h'].get(b_code))
                 is_tw = info['p'] > 0 and ('.TW' in b_code or '.TWO' in b_code or b_code.isdigit())
                 ex_type = 'tse' if is_tw else 'US'
                 rate = 1.0 if is_tw else get_usdtwd()
@@ -569,6 +664,32 @@ with st.sidebar:
                 log_transaction(client, username, "賣出", s_code, s_price, s_qty)
                 st.success("賣出成功"); time.sleep(1); st.rerun()
 
+    with st.expander("🔔 價格警示"):
+        alerts = lazy_import("alerts")
+        alert_engine = get_alert_engine(username)
+        a_kind = st.selectbox("條件", list(alerts.RULE_KINDS), format_func=alerts.RULE_KINDS.get)
+        if a_kind == 'drawdown':
+            a_symbol, a_op = alerts.PORTFOLIO, '>='
+        else:
+            a_symbol = st.selectbox("股票", list(data['h']), key="alert_symbol")
+            a_op = st.radio("方向", ['>=', '<='], horizontal=True)
+        a_val = st.number_input("門檻", value=0.0, step=1.0)
+        if st.button("新增警示") and a_symbol:
+            alert_engine.add_rule(a_kind, a_symbol, a_op, a_val)
+            st.rerun()
+        
+        for rule in list(alert_engine.rules.values()):
+            r1, r2 = st.columns([4, 1])
+            r1.caption(alert_engine.describe(rule))
+            if r2.button("✖", key=f"del_alert_{rule['id']}"):
+                alert_engine.remove_rule(rule['id'])
+                st.rerun()
+        
+        if alert_engine.fired:
+            st.markdown("**最近觸發**")
+            for a in alert_engine.fired[-10:][::-1]:
+                st.caption(f"{a['time']} {a['message']}")
+
     if st.button("📋 異動歷程"):
         logs = get_audit_logs(client, username)
         show_audit_log_modal(logs)
@@ -629,11 +750,18 @@ for row in table_rows:
 net_asset = data['cash'] + total_mkt - total_debt
 roi_pct = ((net_asset - data['principal']) / data['principal'] * 100) if data['principal'] else 0
 
+# 投組回撤警示 (淨資產未變動時引擎直接略過)，並顯示上一輪更新股價時觸發的警示
+alert_engine = get_alert_engine(username)
+peak_asset = max([a['NetAsset'] for a in data.get('asset_history', [])] + [net_asset])
+alert_engine.on_portfolio(net_asset, peak_asset)
+for a in alert_engine.pop_pending():
+    st.toast(f"🔔 {a['message']}")
+
 # 更新股價與紀錄
 if st.button("🔄 更新即時股價", type="primary", use_container_width=True):
     with st.spinner("更新中... (優先使用 TWSE)"):
         data['usdtwd'] = get_usdtwd()
-        st.session_state.quotes = update_prices_batch(data['h'])
+        st.session_state.quotes = update_prices_batch(data['h'], on_quote=get_alert_engine(username).on_quote)
         data['last_update'] = datetime.now().strftime('%Y/%m/%d %H:%M:%S')
         save_data(client, username, data)
         record_asset_history(client, username, net_asset, data['principal'])
@@ -664,9 +792,14 @@ kp2.metric("💰 總損益 (含已實現)", f"${total_profit_all:,.0f}")
 kp3.metric("🏆 總報酬率 (ROI)", f"{roi_pct:+.2f}%")
 kp4.metric("📥 其中已實現", f"${total_realized:,.0f}")
 
+perf_mark("first_paint_dashboard_ms")
+
 st.markdown("---")
 
-tab1, tab2, tab3, tab4 = st.tabs(["📋 庫存明細", "🗺️ 熱力圖", "📊 資產走勢", "📜 已實現損益"])
+# 表格與圖表才需要 pandas / plotly，延後到首次繪製之後才載入
+pd = lazy_import("pandas")
+
+tab1, tab2, tab3, tab4, tab5 = st.tabs(["📋 庫存明細", "🗺️ 熱力圖", "📊 資產走勢", "📜 已實現損益", "🎲 情境模擬"])
 
 def style_color(v):
     try: return 'color: red' if float(v) > 0 else 'color: green' if float(v) < 0 else ''
@@ -692,6 +825,7 @@ with tab1:
 
 with tab2:
     if table_rows:
+        px = lazy_import("plotly.express")
         df_tree = pd.DataFrame(table_rows)
         fig = px.treemap(
             df_tree, path=['股票代碼'], values='mkt_val_raw', color='日損益%',
@@ -732,29 +866,10 @@ with tab3:
         else:
             df_h = pd.concat([df_h, new_row], ignore_index=True)
 
-        view_type = st.radio("顯示模式", ["💰 淨資產走勢 (金額)", "📈 累計報酬率比較 (%)"], horizontal=True)
-        
-        fig_trend = go.Figure()
+        view_type = st.radio("顯示模式", [TREND_VIEW_AMOUNT, TREND_VIEW_ROI], horizontal=True)
         
-        if view_type == "💰 淨資產走勢 (金額)":
-            fig_trend.add_trace(go.Scatter(x=df_h['Date'], y=df_h['NetAsset'], name='淨資產', fill='tozeroy', line=dict(color='#00CC96')))
-            fig_trend.add_trace(go.Scatter(x=df_h['Date'], y=df_h['Principal'], name='投入本金', line=dict(color='#EF553B', dash='dot')))
-            fig_trend.update_layout(yaxis_title="金額 (TWD)")
-        else:
-            df_h['ROI'] = ((df_h['NetAsset'] - df_h['Principal']) / df_h['Principal']) * 100
-            fig_trend.add_trace(go.Scatter(x=df_h['Date'], y=df_h['ROI'], name='我的投資組合', line=dict(color='#00CC96', width=3)))
-            
-            if not df_h.empty:
-                start_date = df_h['Date'].iloc[0].strftime('%Y-%m-%d')
-                benchmarks = get_benchmark_data(start_date)
-                colors = ['#636EFA', '#AB63FA', '#FFA15A']
-                for i, (name, series) in enumerate(benchmarks.items()):
-                    fig_trend.add_trace(go.Scatter(x=series.index, y=series.values, name=name, line=dict(color=colors[i%len(colors)], width=1.5, dash='dot')))
-            
-            fig_trend.update_layout(yaxis_title="累計報酬率 (%)")
-
-        fig_trend.update_layout(hovermode="x unified", height=450)
-        st.plotly_chart(fig_trend, use_container_width=True)
+        fig_json = build_trend_figure_json(trend_data_version(df_h), view_type, df_h)
+        st.plotly_chart(json.loads(fig_json), use_container_width=True)
     else:
         st.info("尚無歷史資產資料 (請執行一次更新即時股價以建立紀錄)")
 
@@ -765,3 +880,94 @@ with tab4:
         st.dataframe(df_r, use_container_width=True, hide_index=True)
     else:
         st.info("尚無已實現損益紀錄")
+
+with tab5:
+    if table_rows:
+        sim = lazy_import("simulator")
+        c1, c2, c3, c4 = st.columns(4)
+        n_paths = c1.number_input("模擬路徑數", min_value=1000, max_value=200000, value=10000, step=1000)
+        horizon = c2.number_input("模擬天數", min_value=5, max_value=756, value=252, step=21)
+        confidence = c3.selectbox("信賴水準", [0.95, 0.99], format_func=lambda v: f"{v:.0%}")
+        workers = c4.number_input("平行行程數 (0=自動)", min_value=0, max_value=os.cpu_count() or 1, value=0)
+        
+        st.caption("目標權重 (%)：預設為目前權重，設為 0 表示全數出清")
+        df_w = pd.DataFrame({
+            "股票代碼": [r["股票代碼"] for r in table_rows],
+            "目前權重%": [r["占比"] * 100 for r in table_rows],
+            "目標權重%": [r["占比"] * 100 for r in table_rows],
+        })
+        df_w = st.data_editor(df_w, disabled=["股票代碼", "目前權重%"], hide_index=True, use_container_width=True)
+        
+        # 模擬結果僅在參數與持股 (代碼/股數) 都未變動時顯示
+        sim_signature = (int(n_paths), int(horizon), confidence, tuple((r["股票代碼"], r["股數"]) for r in table_rows))
+        
+        if st.button("▶️ 執行模擬", type="primary"):
+            holdings_key = tuple((r["股票代碼"], data['h'].get(r["股票代碼"], {}).get('ex', '')) for r in table_rows)
+            with st.spinner("下載歷史股價並模擬中..."):
+                prices = get_price_history(holdings_key)
+                valid_days = prices.notna().sum() if prices is not None else None
+                # 只取所有持股都有報價的共同區間，避免缺資料的持股被當成零報酬 (無風險) 模擬
+                prices = prices.dropna() if prices is not None else None
+                if valid_days is None:
+                    st.error("無法取得歷史股價，無法模擬")
+                elif (valid_days == 0).any():
+                    st.error(f"無法取得以下持股的歷史股價: {', '.join(valid_days[valid_days == 0].index)}")
+                elif len(prices) < SIM_MIN_HISTORY_DAYS:
+                    short = valid_days[valid_days < SIM_MIN_HISTORY_DAYS].index
+                    st.error(f"共同歷史區間僅 {len(prices)} 天，資料不足的持股: {', '.join(short) or '無'}")
+                else:
+                    t0 = time.perf_counter()
+                    st.session_state.sim_result = sim.run_monte_carlo(
+                        sim.daily_log_returns(prices.to_numpy()),
+                        [r["mkt_val_raw"] for r in table_rows],
+                        n_paths=int(n_paths), horizon=int(horizon), confidence=confidence,
+                        workers=int(workers) or None
+                    )
+                    perf_mark("simulation_ms", (time.perf_counter() - t0) * 1000)
+                    st.session_state.sim_result['history'] = f"{prices.index[0]:%Y-%m-%d} ~ {prices.index[-1]:%Y-%m-%d} ({len(prices)} 天)"
+                    st.session_state.sim_result['signature'] = sim_signature
+        
+        res = st.session_state.get('sim_result')
+        if res and res.get('signature') != sim_signature:
+            st.session_state.pop('sim_result', None)
+            res = None
+            st.info("模擬參數或持股已變更，請重新執行模擬")
+        if res:
+            st.caption(f"{res['paths']:,} 條路徑 × {res['horizon']} 天，起始市值 ${res['start_value']:,.0f}，歷史區間 {res['history']}")
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric(f"VaR ({res['confidence']:.0%})", f"${res['var']:,.0f}")
+            m2.metric("CVaR (預期尾端損失)", f"${res['cvar']:,.0f}")
+            m3.metric("預期最大回撤", f"{res['expected_drawdown']:.1%}", f"P95 {res['drawdown_p95']:.1%}", delta_color="off")
+            m4.metric("預期報酬", f"{res['expected_return']:+.2%}")
+            
+            px = lazy_import("plotly.express")
+            fig_sim = px.histogram(x=res['terminal_values'], nbins=60, labels={'x': '期末市值 (TWD)'})
+            fig_sim.update_layout(height=300, margin=dict(t=10, l=0, r=0, b=0), showlegend=False)
+            st.plotly_chart(fig_sim, use_container_width=True)
+        
+        st.markdown("##### ⚖️ 再平衡交易")
+        try:
+            trades = sim.rebalance_trades(
+                [r["股票代碼"] for r in table_rows],
+                [r["mkt_val_raw"] for r in table_rows],
+                [(r["mkt_val_raw"] / r["股數"]) if r["股數"] else 0 for r in table_rows],
+                dict(zip(df_w["股票代碼"], df_w["目標權重%"].fillna(0)))
+            )
+            df_t = pd.DataFrame(trades).rename(columns={
+                'code': '股票代碼', 'current': '目前市值', 'target': '目標市值',
+                'trade_value': '交易金額', 'trade_shares': '交易股數'
+            })
+            st.dataframe(
+                df_t.style.format({"目前市值": "{:,.0f}", "目標市值": "{:,.0f}", "交易金額": "{:+,.0f}", "交易股數": "{:+,.0f}"})
+                .map(style_color, subset=['交易金額', '交易股數']),
+                use_container_width=True, hide_index=True
+            )
+        except ValueError as e:
+            st.warning(f"無法計算再平衡: {e}")
+    else:
+        st.info("尚無庫存可供模擬")
+
+perf_mark("full_render_dashboard_ms")
+if show_perf():
+    with st.sidebar.expander("⏱️ 效能指標"):
+        st.json(PERF_MARKS)
@@ -0,0 +1,233 @@
+"""舊版 JSON 帳戶 (User_* 分頁 A1 儲存整包 JSON) 的格式遷移。
+
+離線批次執行 (建議在上線前跑一次，使用者登入時就不必等待遷移)：
+
+    python migration.py --secrets .streamlit/secrets.toml [--workers 4] [--dry-run]
+
+流程：
+1. 一次 metadata 讀取：列出所有分頁，並以單一 batchGet 讀取每個 User_* 的 A1 判斷是否為舊版格式
+2. 多執行緒並行轉換各帳戶，每個帳戶只有一次 batchGet 讀取與一次 batchUpdate 寫入
+3. 寫入後回讀驗證持股/資金/已實現的總數，不符時清空本次寫入的 Account_ / Realized_ 並將 User_ 還原為原始 JSON
+4. 可重複執行：已遷移帳戶的 A1 已是 'Code' 表頭，下次偵測時自動略過
+
+任何寫入前都會先把原始 A1 JSON 備份到 backups/<user>.json (已存在則保留最早的版本)；
+寫入一律先覆寫再清除多餘範圍，過程中不會出現 User_ 為空的空窗。
+
+本模組不 import streamlit；資料格式與連線相關的共用函式在 storage.py。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import gspread
+from gspread.utils import rowcol_to_a1
+
+from storage import (
+    authorize_client, build_realized_rows, build_user_rows, clean_num,
+    is_legacy_cell, legacy_history, legacy_holdings, load_legacy_json,
+)
+
+VERIFY_TOLERANCE = 0.01
+MAX_RETRIES = 5
+BACKUP_DIR = 'backups'
+
+
+# --- Google Sheets 批次操作 ---
+def _rng(title, cells=None):
+    quoted = "'" + title.replace("'", "''") + "'"
+    return f"{quoted}!{cells}" if cells else quoted
+
+def _with_retry(fn, *args, **kwargs):
+    """遇到配額 (429) 或暫時性錯誤時指數退避重試"""
+    for attempt in range(MAX_RETRIES):
+        try:
+            return fn(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            status = getattr(getattr(e, 'response', None), 'status_code', 0)
+            if status not in (429, 500, 503) or attempt == MAX_RETRIES - 1: raise
+            time.sleep(2 ** attempt)
+
+def _batch_get(spreadsheet, ranges):
+    res = _with_retry(spreadsheet.values_batch_get, ranges, params={'valueRenderOption': 'UNFORMATTED_VALUE'})
+    return [vr.get('values', []) for vr in res.get('valueRanges', [])]
+
+def _batch_write(spreadsheet, data):
+    body = {'valueInputOption': 'RAW', 'data': [{'range': r, 'values': v} for r, v in data]}
+    return _with_retry(spreadsheet.values_batch_update, body)
+
+def _outside(ws, n_rows, n_cols):
+    """ws 中 A1 起 n_rows x n_cols 以外的範圍 (用於先寫入、再清除殘留儲存格)"""
+    ranges = []
+    if ws.col_count > n_cols:
+        ranges.append(_rng(ws.title, f"{rowcol_to_a1(1, n_cols + 1)}:{rowcol_to_a1(n_rows, ws.col_count)}"))
+    if ws.row_count > n_rows:
+        ranges.append(_rng(ws.title, f"A{n_rows + 1}:{rowcol_to_a1(ws.row_count, ws.col_count)}"))
+    return ranges
+
+def _backup_legacy(backup_dir, username, raw_json):
+    """寫入前先把原始 JSON 存到本機；已有備份時保留最早的版本"""
+    os.makedirs(backup_dir, exist_ok=True)
+    path = os.path.join(backup_dir, f"{username}.json")
+    if not os.path.exists(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'user': username, 'a1': raw_json}, f, ensure_ascii=False)
+    return path
+
+def _totals(h_rows, cash, principal, r_rows):
+    """遷移前後比對用的彙總值：持股數、股數合計、成本合計、現金、本金、已實現筆數與損益合計"""
+    return {
+        'holdings': len(h_rows),
+        'shares': sum(clean_num(r[3]) for r in h_rows if len(r) > 4),
+        'cost': sum(clean_num(r[3]) * clean_num(r[4]) for r in h_rows if len(r) > 4),
+        'cash': clean_num(cash),
+        'principal': clean_num(principal),
+        'realized': len(r_rows),
+        'profit': sum(clean_num(r[6]) for r in r_rows if len(r) > 6),
+    }
+
+def _totals_match(a, b):
+    return all(abs(a[k] - b[k]) <= VERIFY_TOLERANCE * max(1.0, abs(a[k])) for k in a)
+
+def list_sheets(spreadsheet):
+    """一次 metadata 讀取，回傳 {小寫標題: worksheet} (與 app.get_ws_ci 同樣忽略大小寫)"""
+    return {ws.title.lower(): ws for ws in _with_retry(spreadsheet.worksheets)}
+
+def detect_legacy_users(spreadsheet, sheets=None):
+    """以單一 batchGet 讀取所有 User_* 的 A1，回傳仍為舊版格式的使用者名稱"""
+    sheets = sheets if sheets is not None else list_sheets(spreadsheet)
+    user_titles = [ws.title for key, ws in sheets.items() if key.startswith('user_')]
+    if not user_titles: return []
+    a1_values = _batch_get(spreadsheet, [_rng(t, 'A1') for t in user_titles])
+    return [t[len('User_'):] for t, vals in zip(user_titles, a1_values)
+            if vals and vals[0] and is_legacy_cell(vals[0][0])]
+
+def migrate_account(spreadsheet, username, sheets=None, dry_run=False, backup_dir=BACKUP_DIR):
+    """
+    將單一舊版帳戶轉為新版分頁格式。
+
+    先備份原始 JSON，再以同一次 batchUpdate 寫入 User_ 與 Account_ / Realized_ (後兩者僅在不存在或為空時)，
+    最後才清除 User_ 新資料以外的殘留儲存格。User_ 的 A1 由 JSON 變為表頭即代表遷移完成。
+    回傳 dict: user / status / totals / backup。
+    """
+    sheets = sheets if sheets is not None else list_sheets(spreadsheet)
+    user_ws = sheets.get(f"user_{username}".lower())
+    if user_ws is None:
+        return {'user': username, 'status': 'missing'}
+    acc_ws = sheets.get(f"account_{username}".lower())
+    real_ws = sheets.get(f"realized_{username}".lower())
+
+    ranges = [_rng(user_ws.title, 'A1')]
+    if acc_ws: ranges.append(_rng(acc_ws.title, 'A1:B'))
+    if real_ws: ranges.append(_rng(real_ws.title, 'A1:A2'))
+    values = _batch_get(spreadsheet, ranges)
+    raw_json = values[0][0][0] if values[0] and values[0][0] else ''
+    if not is_legacy_cell(raw_json):
+        return {'user': username, 'status': 'skipped'}
+
+    legacy = load_legacy_json(raw_json)
+    h_data = legacy_holdings(legacy)
+    history = legacy_history(legacy)
+    user_rows = build_user_rows(h_data)
+
+    # 已有 Account_ 資料時以其為準 (與 load_data 的優先順序相同)，不覆寫
+    acc_rows = values[1] if acc_ws else []
+    acc_map = {str(r[0]): r[1] for r in acc_rows if len(r) >= 2}
+    write_account = not acc_map
+    if write_account:
+        acc_map = {'Cash': clean_num(legacy.get('cash', 0)), 'Principal': clean_num(legacy.get('principal', 0))}
+        acc_rows = [['Key', 'Value'], ['Cash', acc_map['Cash']], ['Principal', acc_map['Principal']], ['LastUpdate', ''], ['USDTWD', 32.5]]
+
+    # 已實現分頁已有資料時保留 (與原本登入時遷移的行為相同)
+    write_realized = bool(history) and (real_ws is None or len(values[-1]) <= 1)
+    realized_rows = build_realized_rows(history) if write_realized else []
+
+    expected = _totals(user_rows[1:], acc_map.get('Cash'), acc_map.get('Principal'), realized_rows[1:])
+    if dry_run:
+        return {'user': username, 'status': 'dry-run', 'totals': expected}
+
+    backup = _backup_legacy(backup_dir, username, raw_json)
+    if write_account and acc_ws is None:
+        acc_ws = _with_retry(spreadsheet.add_worksheet, f"Account_{username}", 20, 2)
+    if write_realized and real_ws is None:
+        real_ws = _with_retry(spreadsheet.add_worksheet, f"Realized_{username}", max(100, len(realized_rows) + 10), 10)
+    # 既有分頁 (如 get_worksheet 建立的 100 列 Realized_) 的格數可能不足，兩者一併處理
+    if len(user_rows) > user_ws.row_count:
+        _with_retry(user_ws.resize, rows=len(user_rows) + 10)
+    if write_realized and len(realized_rows) > real_ws.row_count:
+        _with_retry(real_ws.resize, rows=len(realized_rows) + 10)
+
+    writes = [(_rng(user_ws.title, 'A1'), user_rows)]
+    if write_account: writes.append((_rng(acc_ws.title, 'A1'), acc_rows))
+    if write_realized: writes.append((_rng(real_ws.title, 'A1'), realized_rows))
+    _batch_write(spreadsheet, writes)
+    # 與 save_data 的 clear 效果相同，但在新資料寫入後才清除，避免 User_ 出現空窗
+    leftover = _outside(user_ws, len(user_rows), len(user_rows[0]))
+    if leftover: _with_retry(spreadsheet.values_batch_clear, body={'ranges': leftover})
+
+    # 回讀驗證：本次有寫入的分頁都從試算表重新讀取，不使用記憶體中的值
+    check = [_rng(user_ws.title)]
+    if write_account: check.append(_rng(acc_ws.title, 'A1:B'))
+    if write_realized: check.append(_rng(real_ws.title))
+    got = _batch_get(spreadsheet, check)
+    got_acc = {str(r[0]): r[1] for r in got[1] if len(r) >= 2} if write_account else acc_map
+    got_realized = got[-1][1:] if write_realized else []
+    actual = _totals(got[0][1:], got_acc.get('Cash'), got_acc.get('Principal'), got_realized)
+    if not _totals_match(expected, actual):
+        # 先把 JSON 寫回 A1 (帳戶立即恢復為舊版，重跑會再次偵測到)，再清除其餘新資料。
+        # Account_ / Realized_ 只在原本不存在或為空時才寫入，清空即回到遷移前狀態；重跑時會重新寫入
+        _batch_write(spreadsheet, [(_rng(user_ws.title, 'A1'), [[raw_json]])])
+        restore = _outside(user_ws, 1, 1)
+        if write_account: restore.append(_rng(acc_ws.title))
+        if write_realized: restore.append(_rng(real_ws.title))
+        _with_retry(spreadsheet.values_batch_clear, body={'ranges': restore})
+        return {'user': username, 'status': 'rolled-back', 'totals': expected, 'actual': actual, 'backup': backup}
+
+    return {'user': username, 'status': 'migrated', 'totals': expected, 'backup': backup}
+
+
+# --- 命令列 ---
+def _load_secrets(path):
+    import tomllib
+    with open(path, 'rb') as f:
+        return tomllib.load(f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批次遷移舊版 JSON 帳戶至新版分頁格式")
+    parser.add_argument('--secrets', default='.streamlit/secrets.toml', help="Streamlit secrets.toml 路徑")
+    parser.add_argument('--workers', type=int, default=4, help="並行遷移的帳戶數 (注意 Sheets API 每分鐘寫入配額)")
+    parser.add_argument('--user', action='append', help="只遷移指定使用者 (可重複)")
+    parser.add_argument('--dry-run', action='store_true', help="只偵測與試算，不寫入")
+    parser.add_argument('--backup-dir', default=BACKUP_DIR, help="寫入前備份原始 JSON 的目錄")
+    args = parser.parse_args(argv)
+
+    secrets = _load_secrets(args.secrets)
+    client = authorize_client(secrets['service_account_info'])
+    spreadsheet = client.open(secrets['spreadsheet_name'])
+
+    sheets = list_sheets(spreadsheet)
+    users = detect_legacy_users(spreadsheet, sheets)
+    if args.user:
+        wanted = {u.lower() for u in args.user}
+        users = [u for u in users if u.lower() in wanted]
+    print(f"偵測到 {len(users)} 個舊版帳戶")
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(migrate_account, spreadsheet, u, sheets, args.dry_run, args.backup_dir): u for u in users}
+        for fut in as_completed(futures):
+            try:
+                res = fut.result()
+            except Exception as e:
+                res = {'user': futures[fut], 'status': 'error', 'error': str(e)}
+            if res['status'] in ('error', 'rolled-back', 'missing'): failed += 1
+            print(json.dumps(res, ensure_ascii=False))
+
+    print(f"完成：{len(users) - failed} 成功，{failed} 失敗 (失敗帳戶維持舊版格式，可直接重新執行)")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
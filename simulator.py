@@ -0,0 +1,137 @@
+"""情境模擬引擎：以歷史日報酬 bootstrap 產生未來路徑，估算 VaR / 回撤並計算再平衡交易。
+
+本模組只依賴 NumPy (不 import streamlit)，可被 ProcessPoolExecutor 的子行程匯入。
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+CHUNK_CELLS = 12_500_000            # 每批 路徑數 x 天數 x 檔數 上限 (每個 float32 暫存陣列約 50MB)
+PARALLEL_MIN_CELLS = 500_000_000     # 路徑數 x 天數 x 檔數 超過此值才值得開 process pool
+
+
+def _simulate_chunk(log_returns, weights, n_paths, horizon, seed):
+    """產生一批路徑，回傳 (期末價值, 最大回撤)，全部以 NumPy 向量化運算"""
+    rng = np.random.default_rng(seed)
+    # 整列 (同一天所有持股) 一起抽樣，保留持股間的相關性
+    day_idx = rng.integers(0, log_returns.shape[0], size=(n_paths, horizon))
+    growth = np.exp(np.cumsum(log_returns[day_idx], axis=1))   # (paths, horizon, holdings)
+    values = growth @ weights                                     # (paths, horizon)
+
+    start = np.full((n_paths, 1), weights.sum(), dtype=values.dtype)
+    values = np.concatenate([start, values], axis=1)
+    peaks = np.maximum.accumulate(values, axis=1)
+    max_dd = ((peaks - values) / peaks).max(axis=1)
+    return values[:, -1], max_dd
+
+
+def _simulate_chunk_args(args):
+    return _simulate_chunk(*args)
+
+
+def chunk_paths_for(horizon, n_holdings, cell_budget=CHUNK_CELLS):
+    """依天數與檔數決定每批路徑數，使單批記憶體用量固定，不受模擬天數影響"""
+    return max(1, cell_budget // max(1, horizon * n_holdings))
+
+
+def _pool_context():
+    """Streamlit 伺服器是多執行緒行程，fork 不安全，改用 forkserver (不支援時用 spawn)"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def daily_log_returns(prices):
+    """將收盤價矩陣 (天數 x 檔數，可含 NaN) 轉為日對數報酬，休市日視為 0 報酬"""
+    prices = np.asarray(prices, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = prices[1:] / prices[:-1]
+    ratio[~np.isfinite(ratio) | (ratio <= 0)] = 1.0
+    return np.log(ratio).astype('float32')
+
+
+def run_monte_carlo(log_returns, values, n_paths=10000, horizon=252, confidence=0.95,
+                    seed=None, chunk_paths=None, workers=None):
+    """
+    對目前持股做 bootstrap 蒙地卡羅模擬 (買入持有，不中途再平衡)。
+
+    log_returns: (歷史天數, 檔數) 日對數報酬
+    values:      (檔數,) 目前各持股市值 (TWD)
+    chunk_paths: 每批路徑數，None = 依 CHUNK_CELLS 自動計算
+    workers:     None = 依運算量自動決定；1 = 單行程；>1 = 指定 process pool 大小
+    """
+    log_returns = np.asarray(log_returns, dtype='float32')
+    values = np.asarray(values, dtype='float32')
+    if log_returns.ndim != 2 or log_returns.shape[1] != values.shape[0]:
+        raise ValueError("log_returns 欄數必須與持股數相同")
+    if log_returns.shape[0] < 2:
+        raise ValueError("歷史報酬資料不足")
+
+    if chunk_paths is None:
+        chunk_paths = chunk_paths_for(horizon, values.shape[0])
+    chunks = []
+    remain = int(n_paths)
+    while remain > 0:
+        chunks.append(min(chunk_paths, remain))
+        remain -= chunks[-1]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    jobs = [(log_returns, values, n, horizon, s) for n, s in zip(chunks, seeds)]
+
+    if workers is None:
+        cells = n_paths * horizon * values.shape[0]
+        workers = min(os.cpu_count() or 1, len(chunks)) if cells >= PARALLEL_MIN_CELLS else 1
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as pool:
+            results = list(pool.map(_simulate_chunk_args, jobs))
+    else:
+        results = [_simulate_chunk_args(j) for j in jobs]
+
+    terminal = np.concatenate([r[0] for r in results]).astype('float64')
+    max_dd = np.concatenate([r[1] for r in results]).astype('float64')
+    start_val = float(values.sum())
+    pnl = terminal - start_val
+    cutoff = np.quantile(pnl, 1 - confidence)
+
+    return {
+        'start_value': start_val,
+        'paths': int(n_paths),
+        'horizon': int(horizon),
+        'confidence': confidence,
+        # VaR / CVaR 為損失金額，尾端結果仍為獲利時記為 0；原始分位數損益另存 pnl_percentile
+        'var': max(0.0, float(-cutoff)),
+        'cvar': max(0.0, float(-pnl[pnl <= cutoff].mean())),
+        'pnl_percentile': float(cutoff),
+        'expected_drawdown': float(max_dd.mean()),
+        'drawdown_p95': float(np.quantile(max_dd, 0.95)),
+        'expected_return': float(pnl.mean() / start_val) if start_val else 0.0,
+        'terminal_values': terminal,
+    }
+
+
+def rebalance_trades(codes, values, prices, target_weights):
+    """
+    計算從目前市值調整到目標權重所需的交易。
+
+    target_weights: {code: weight}，未列出的持股視為 0 (全數賣出)，權重會自動正規化。
+    prices:         與 values 同幣別 (TWD) 的每股價格
+    回傳 list of dict: code / current / target / trade_value / trade_shares
+    """
+    values = np.asarray(values, dtype='float64')
+    prices = np.asarray(prices, dtype='float64')
+    w = np.array([max(float(target_weights.get(c, 0)), 0.0) for c in codes])
+    if w.sum() <= 0:
+        raise ValueError("目標權重總和必須大於 0")
+    w = w / w.sum()
+
+    total = values.sum()
+    target_vals = w * total
+    trade_vals = target_vals - values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        trade_shares = np.where(prices > 0, trade_vals / prices, 0.0)
+
+    return [
+        {'code': c, 'current': float(v), 'target': float(t), 'trade_value': float(tv), 'trade_shares': float(ts)}
+        for c, v, t, tv, ts in zip(codes, values, target_vals, trade_vals, trade_shares)
+    ]
@@ -0,0 +1,89 @@
+"""Google Sheets 資料格式與連線的共用函式 (app.py 與 migration.py 共用)。
+
+本模組不 import streamlit，gspread / google-auth 只在建立連線時才載入。
+"""
+import json
+
+USER_HEADERS = ['Code', 'Name', 'Exchange', 'Shares', 'AvgCost', 'Lots_Data', 'LastPrice']
+REALIZED_HEADERS = ['Date', 'Code', 'Name', 'Qty', 'BuyCost', 'SellRev', 'Profit', 'ROI']
+
+
+# --- 資料格式 (數值清理 / 舊版解析 / 分頁資料列) ---
+def clean_num(val):
+    try:
+        if isinstance(val, (int, float)): return float(val)
+        if not val: return 0.0
+        s = str(val).replace(',', '').replace('$', '').replace(' ', '').replace('%', '').strip()
+        return float(s)
+    except: return 0.0
+
+def is_legacy_cell(a1):
+    """User_ 分頁 A1 為 JSON 物件即視為舊版格式"""
+    return str(a1).strip().startswith('{')
+
+def load_legacy_json(raw_json):
+    legacy = json.loads(raw_json)
+    # 雙層解析保護 (若存入時被二次轉字串)
+    if isinstance(legacy, str):
+        legacy = json.loads(legacy)
+    return legacy
+
+def legacy_holdings(legacy):
+    h_data = {}
+    for code, info in legacy.get('h', {}).items():
+        h_data[code] = {
+            'n': info.get('n', code),
+            'ex': info.get('ex', ''),
+            's': clean_num(info.get('s', 0)),
+            'c': clean_num(info.get('c', 0)),
+            'last_p': 0,
+            'lots': info.get('lots', [])
+        }
+    return h_data
+
+def legacy_history(legacy):
+    return [{
+        'Date': h.get('d'), 'Code': h.get('code'), 'Name': h.get('name'),
+        'Qty': h.get('qty'), 'BuyCost': h.get('buy_cost'),
+        'SellRev': h.get('sell_rev'), 'Profit': h.get('profit'), 'ROI': h.get('roi')
+    } for h in legacy.get('history', [])]
+
+def build_user_rows(h_data):
+    """User_ 分頁的表頭與資料列 (save_data 與 migration 共用)"""
+    rows = [USER_HEADERS]
+    for code, info in h_data.items():
+        current_p = info.get('last_p', 0)
+        if current_p == 0: current_p = info.get('c', 0)
+        rows.append([
+            code, info.get('n', ''), info.get('ex', ''),
+            float(info.get('s', 0)), float(info.get('c', 0)),
+            json.dumps(info.get('lots', []), ensure_ascii=False),
+            float(current_p)
+        ])
+    return rows
+
+def build_realized_rows(history):
+    return [REALIZED_HEADERS] + [[h.get(k) for k in REALIZED_HEADERS] for h in history]
+
+
+# --- Google Sheets 連線 ---
+GOOGLE_SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive'
+]
+
+def service_account_dict(secret_info):
+    """將 secrets 中的 service_account_info (JSON 字串或 TOML 表) 正規化為 dict，並修正 private_key 換行"""
+    if isinstance(secret_info, str):
+        creds_dict = json.loads(secret_info, strict=False)
+    else:
+        creds_dict = dict(secret_info)
+    if 'private_key' in creds_dict:
+        creds_dict['private_key'] = creds_dict['private_key'].replace('\\n', '\n')
+    return creds_dict
+
+def authorize_client(secret_info):
+    import gspread
+    from google.oauth2.service_account import Credentials
+    creds = Credentials.from_service_account_info(service_account_dict(secret_info), scopes=GOOGLE_SCOPES)
+    return gspread.authorize(creds)